@@ -7,7 +7,6 @@ from common.s3_utils import download_and_store_locally, poll_s3_for_data
 from common.stac_utils import (
     OrderStatus,
     get_item_hrefs_from_catalogue,
-    get_key_from_stac,
     retrieve_stac_item,
     update_stac_item_failure,
     update_stac_item_ordered,
@@ -69,14 +68,16 @@ class STACItem:
         self.file_path = stac_item_path
         self.file_name = os.path.basename(stac_item_path)
         self.stac_json = retrieve_stac_item(stac_item_path)
-        self.acquisition_id = get_key_from_stac(self.stac_json, "properties.acquisition_identifier")
-        self.collection_id = get_key_from_stac(self.stac_json, "collection")
-        self.coordinates = get_key_from_stac(self.stac_json, "geometry.coordinates")
-        self.multi_acquisition_ids = (
-            get_key_from_stac(self.stac_json, "properties.composed_of_acquisition_identifiers") or []
-        )
-        self.order_status = get_key_from_stac(self.stac_json, "order:status")
-        self.item_uuid = get_key_from_stac(self.stac_json, "properties.id")
+
+        properties = self.stac_json.get("properties") or {}
+        geometry = self.stac_json.get("geometry") or {}
+        self.acquisition_id = properties.get("acquisition_identifier")
+        self.collection_id = self.stac_json.get("collection")
+        self.coordinates = geometry.get("coordinates")
+        self.multi_acquisition_ids = properties.get("composed_of_acquisition_identifiers") or []
+        self.order_status = self.stac_json.get("order:status")
+        self.item_uuid = properties.get("id")
+        logging.info(f"Loaded STAC item {self.acquisition_id} in {self.collection_id} from {stac_item_path}")
         self.item_uuids = []
 
 
@@ -6,7 +6,6 @@ import os
 from common.s3_utils import download_and_store_locally, poll_s3_for_data
 from common.stac_utils import (
     get_item_hrefs_from_catalogue,
-    get_key_from_stac,
     retrieve_stac_item,
     update_stac_item_failure,
     update_stac_item_ordered,
@@ -29,9 +28,11 @@ class STACItem:
         self.file_path = stac_item_path
         self.file_name = os.path.basename(stac_item_path)
         self.stac_json = retrieve_stac_item(stac_item_path)
-        self.acquisition_id = get_key_from_stac(self.stac_json, "id").rsplit("_", 1)[0]
-        self.collection_id = get_key_from_stac(self.stac_json, "collection")
-        self.order_status = get_key_from_stac(self.stac_json, "order:status")
+
+        self.acquisition_id = self.stac_json["id"].rsplit("_", 1)[0]
+        self.collection_id = self.stac_json.get("collection")
+        self.order_status = self.stac_json.get("order:status")
+        logging.info(f"Loaded STAC item {self.acquisition_id} in {self.collection_id} from {stac_item_path}")
 
 
 def prepare_stac_items_to_order(catalogue_dirs: list[str]) -> list[STACItem]:
@@ -27,8 +27,8 @@ def decrypt_airbus_api_key(ciphertext_b64: str, otp_key_b64: str) -> str | None:
         if len(ciphertext) != len(otp_key):
             raise ValueError("Ciphertext and OTP key must be the same length.")
 
-        # XOR decryption
-        plaintext_bytes = bytes(c ^ k for c, k in zip(ciphertext, otp_key, strict=True))
+        # XOR decryption, as a single big integer operation rather than a Python loop over each byte
+        plaintext_bytes = (int.from_bytes(ciphertext) ^ int.from_bytes(otp_key)).to_bytes(len(ciphertext))
 
         try:
             return plaintext_bytes.decode("utf-8")
@@ -5,7 +5,6 @@ import os
 import re
 from datetime import UTC, datetime
 from enum import Enum
-from typing import Any
 
 import boto3
 import pulsar
@@ -303,19 +302,6 @@ def update_stac_order_status(stac_item: dict, order_id: str | None, order_status
         stac_item["stac_extensions"].append(order_extension_url)
 
 
-def get_key_from_stac(stac_item: dict, key: str) -> Any:
-    """Extract a nested key from a STAC item. Key given as a dot-separated string."""
-    parts = key.split(".")
-    value = stac_item
-    for part in parts:
-        value = value.get(part)
-        if value is None:
-            logging.info(f"{part} not found in STAC item.")
-            return None
-    logging.info(f"Retrieved {key} from STAC item: {value}")
-    return value
-
-
 def ingest_stac_item(
     stac_item: dict,
     s3_bucket: str,
@@ -1,17 +1,18 @@
 import argparse
 import asyncio
-import glob
-import json
 import logging
 import mimetypes
 import os
 import re
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from typing import Any
 
-import boto3
 import pulsar
 
 import planet
+from planet_adaptor import json_utils
 from planet_adaptor.api_utils import (
     create_order_request,
     define_delivery,
@@ -23,11 +24,11 @@ from planet_adaptor.s3_utils import (
     download_and_store_locally,
     poll_s3_for_data,
     retrieve_stac_item,
+    upload_stac_items,
 )
 from planet_adaptor.stac_utils import (
     current_time_iso8601,
     get_item_hrefs_from_catalogue,
-    get_key_from_stac,
     update_stac_order_status,
     verify_coordinates,
     write_stac_item_and_catalog,
@@ -40,6 +41,13 @@ logging.basicConfig(
 )
 
 
+# Pulsar messages larger than this are sent in chunks rather than as a single message
+PULSAR_CHUNKING_THRESHOLD_BYTES = 1_000_000
+
+# Maximum number of STAC items read from disk at once
+STAC_ITEM_LOAD_WORKERS = 16
+
+
 class OrderStatus(Enum):
     ORDERABLE = "orderable"
     ORDERED = "ordered"
@@ -75,6 +83,19 @@ regex_patterns = [
     (r"\/[^\\:?\"<>|]+\.tif$", "primaryAsset", "GeoTIFF image file"),
 ]
 
+# MIME types for the file extensions found in Planet deliveries, checked before falling back to mimetypes
+mime_type_map = {
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+    ".json": "application/json",
+    ".xml": "application/xml",
+    ".png": "image/png",
+    ".jp2": "image/jp2",
+    ".txt": "text/plain",
+    ".html": "text/html",
+    ".pdf": "application/pdf",
+}
+
 
 def get_asset_details(file_path: str) -> tuple[str, str]:
     """
@@ -89,6 +110,31 @@ def get_asset_details(file_path: str) -> tuple[str, str]:
     return os.path.basename(file_path), ""
 
 
+def get_mime_type(file_name: str) -> str:
+    """Return the MIME type for a file, defaulting to application/octet-stream"""
+    _, ext = os.path.splitext(file_name)
+    mime_type = mime_type_map.get(ext.lower())
+    if mime_type is None:
+        mime_type, _ = mimetypes.guess_type(file_name)
+    return mime_type or "application/octet-stream"
+
+
+def iter_asset_paths(directory: str) -> Iterator[str]:
+    """Yield the paths of all files below a directory, in the same sorted top-down order as os.walk"""
+    with os.scandir(directory) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+
+    subdirectories = []
+    for entry in entries:
+        if not entry.is_dir():
+            yield entry.path
+        elif not entry.is_symlink():
+            subdirectories.append(entry.path)
+
+    for subdirectory in subdirectories:
+        yield from iter_asset_paths(subdirectory)
+
+
 def update_stac_item_success(
     stac_item: dict,
     file_name: str,
@@ -101,32 +147,26 @@ def update_stac_item_success(
     """Update the STAC item with the assets and success order status"""
     # Add all files in the directory as assets to the STAC item
     name_counter = {}
-    for root, dirs, files in os.walk(directory):
-        dirs.sort()
-        for asset in sorted(files):
-            asset_path = os.path.join(root, asset)
-            asset_name, description = get_asset_details(asset_path)
-
-            # Cannot have duplicate asset names
-            if asset_name in name_counter:
-                # Append an incrementing integer
-                name_counter[asset_name] += 1
-                asset_name = f"{asset_name}_{name_counter[asset_name]}"
-            else:
-                name_counter[asset_name] = 0
-
-            # Determine the MIME type of the file
-            mime_type, _ = mimetypes.guess_type(asset_path)
-            if mime_type is None:
-                mime_type = "application/octet-stream"  # Default MIME type
-
-            # Add asset link to the file
-            stac_item["assets"][asset_name] = {
-                "href": asset_path,
-                "type": mime_type,
-            }
-            if description:
-                stac_item["assets"][asset_name]["title"] = description
+    asset_count = 0
+    for asset_path in iter_asset_paths(directory):
+        asset_count += 1
+        asset_name, description = get_asset_details(asset_path)
+
+        # Cannot have duplicate asset names
+        if asset_name in name_counter:
+            # Append an incrementing integer
+            name_counter[asset_name] += 1
+            asset_name = f"{asset_name}_{name_counter[asset_name]}"
+        else:
+            name_counter[asset_name] = 0
+
+        # Add asset link to the file
+        stac_item["assets"][asset_name] = {
+            "href": asset_path,
+            "type": get_mime_type(asset_path),
+        }
+        if description:
+            stac_item["assets"][asset_name]["title"] = description
     # Mark the order as succeeded and upload the updated STAC item
     update_stac_order_status(stac_item, order_name, OrderStatus.SUCCEEDED.value)
 
@@ -138,9 +178,7 @@ def update_stac_item_success(
     # Create local record of the order, to be used as the workflow output
     write_stac_item_and_catalog(stac_item, file_name, collection_id, order_name, workspace, workspaces_bucket)
 
-    # Adding this for debugging purposes later on, just in case
-    logging.info(f"Files in current working directory: {os.getcwd()}")
-    logging.info(list(glob.iglob("./**/*", recursive=True)))
+    logging.info(f"Added {asset_count} assets from '{directory}' to STAC item.")
 
 
 def update_stac_item_failure(
@@ -203,25 +241,16 @@ def ingest_stac_item(
 ) -> None:
     """Ingest the STAC item to the S3 bucket and send a Pulsar message"""
     # Upload the STAC item to S3
-    s3_client = boto3.client("s3")
     parent_catalog_name = "commercial-data"
 
     item_key = f"{workspace}/{parent_catalog_name}/planet/{collection_id}/{item_id}.json"
-    s3_client.put_object(Body=json.dumps(stac_item), Bucket=s3_bucket, Key=item_key)
-
-    logging.info(f"Uploaded STAC item to S3 bucket '{s3_bucket}' with key '{item_key}'.")
-
     transformed_item_key = (
         f"transformed/catalogs/user/catalogs/{workspace}/catalogs/{parent_catalog_name}/catalogs/"
         f"planet/collections/{collection_id}/items/{item_id}.json"
     )
-    s3_client.put_object(Body=json.dumps(stac_item), Bucket=s3_bucket, Key=transformed_item_key)
-
-    logging.info(f"Uploaded STAC item to S3 bucket '{s3_bucket}' with key '{transformed_item_key}'.")
+    upload_stac_items(s3_bucket, {item_key: stac_item, transformed_item_key: stac_item})
 
     # Send a Pulsar message
-    pulsar_client = pulsar.Client(pulsar_url)
-    producer = pulsar_client.create_producer(topic="transformed", producer_name=f"data_adaptor-{workspace}-{item_id}")
     output_data = {
         "id": f"{workspace}/update_order",
         "workspace": workspace,
@@ -232,7 +261,18 @@ def ingest_stac_item(
         "source": "/",
         "target": "/",
     }
-    producer.send((json.dumps(output_data)).encode("utf-8"))
+    payload = json_utils.dumps(output_data)
+
+    # Only split the message into chunks when it is too large to send comfortably in one piece
+    pulsar_client = pulsar.Client(pulsar_url)
+    producer = pulsar_client.create_producer(
+        topic="transformed",
+        producer_name=f"data_adaptor-{workspace}-{item_id}",
+        chunking_enabled=len(payload) > PULSAR_CHUNKING_THRESHOLD_BYTES,
+        send_timeout_millis=30_000,
+        max_pending_messages=1000,
+    )
+    producer.send(payload)
     logging.info(f"Sent Pulsar message {output_data}.")
 
     # Close the Pulsar client
@@ -241,15 +281,21 @@ def ingest_stac_item(
 
 async def get_existing_order_details(workspace: str, order_name: str) -> dict:
     """Retrieve details of an existing order from the Planet API"""
-    planet_api_key = get_planet_api_key(workspace)
+    # Fetching the key blocks on Kubernetes and Secrets Manager calls, so keep it off the event loop
+    planet_api_key = await asyncio.to_thread(get_planet_api_key, workspace)
     auth = planet.Auth.from_key(planet_api_key)
 
     session = planet.Session(auth=auth)
     orders_client = planet.OrdersClient(session=session)
 
-    async for order in orders_client.list_orders():
-        if order["name"] == order_name:
-            return order
+    try:
+        async for order in orders_client.list_orders():
+            if order["name"] == order_name:
+                return order
+    except planet.exceptions.InvalidAPIKey:
+        # The cached key has been rejected, so fetch it again next time
+        get_planet_api_key.cache_clear()
+        raise
     return {}
 
 
@@ -269,10 +315,14 @@ class STACItem:
         self.file_path = stac_item_path
         self.file_name = os.path.basename(stac_item_path)
         self.stac_json = retrieve_stac_item(stac_item_path)
-        self.item_id = get_key_from_stac(self.stac_json, "id")
-        self.collection_id = get_key_from_stac(self.stac_json, "properties.item_type")
-        self.coordinates = get_key_from_stac(self.stac_json, "geometry.coordinates")
-        self.order_status = get_key_from_stac(self.stac_json, "order:status")
+
+        properties = self.stac_json.get("properties") or {}
+        geometry = self.stac_json.get("geometry") or {}
+        self.item_id: Any = self.stac_json.get("id")
+        self.collection_id: Any = properties.get("item_type")
+        self.coordinates: Any = geometry.get("coordinates")
+        self.order_status: Any = self.stac_json.get("order:status")
+        logging.info(f"Loaded STAC item {self.item_id} in {self.collection_id} from {stac_item_path}")
 
 
 def prepare_stac_items_to_order(catalogue_dirs: list[str]) -> list[STACItem]:
@@ -286,104 +336,61 @@ def prepare_stac_items_to_order(catalogue_dirs: list[str]) -> list[STACItem]:
         raise ValueError("No STAC items found in the given directories.")
     logging.info(f"STAC item paths: {stac_item_paths}")
 
-    stac_items = []
-
-    for stac_item_path in stac_item_paths:
-        stac_item_to_add = STACItem(stac_item_path)
-        stac_items.append(stac_item_to_add)
+    # Load the STAC items concurrently, preserving their order. The first failure is re-raised here.
+    with ThreadPoolExecutor(max_workers=STAC_ITEM_LOAD_WORKERS) as executor:
+        stac_items = list(executor.map(STACItem, stac_item_paths))
 
     return stac_items
 
 
-def main(
+def order_stac_item(
+    stac_item: STACItem,
     workspace: str,
     workspace_bucket: str,
     commercial_data_bucket: str,
     pulsar_url: str,
     product_bundle_category: str,
     coordinates: list,
-    catalogue_dirs: list[str],
-) -> None:
-    """Submit an order for an acquisition, retrieve the data, and update the STAC item"""
-    # Workspace STAC item should already be generated and ingested, with an order status of ordered.
-    logging.info(f"Preparing {product_bundle_category} data for {workspace} for the following: {catalogue_dirs}")
-    stac_items: list[STACItem] = prepare_stac_items_to_order(catalogue_dirs)
-
-    for stac_item in stac_items:
-        collection_id = stac_item.collection_id
-        if collection_id not in product_bundle_map:
-            raise NotImplementedError(
-                f"Collection {collection_id} is not valid. Currently implemented collections are "
-                f"{product_bundle_map.keys()}"
-            )
-
-        try:
-            product_bundle = product_bundle_map[collection_id][product_bundle_category]
+) -> str:
+    """Submit an order for a single STAC item, retrieve the data, and return the final order status"""
+    collection_id = stac_item.collection_id
+    if collection_id not in product_bundle_map:
+        raise NotImplementedError(
+            f"Collection {collection_id} is not valid. Currently implemented collections are "
+            f"{product_bundle_map.keys()}"
+        )
 
-        except KeyError as e:
-            raise NotImplementedError(
-                f"Product bundle {product_bundle_category} is not valid. Currently implemented bundles are "
-                f"{product_bundle_map[collection_id].keys()} for {collection_id}"
-            ) from e
+    try:
+        product_bundle = product_bundle_map[collection_id][product_bundle_category]
 
-        item_id = stac_item.item_id.rsplit("_", 1)[0]
-        order_name = f"{stac_item.item_id}-{workspace}"
+    except KeyError as e:
+        raise NotImplementedError(
+            f"Product bundle {product_bundle_category} is not valid. Currently implemented bundles are "
+            f"{product_bundle_map[collection_id].keys()} for {collection_id}"
+        ) from e
 
-        logging.info(f"Coordinates: {coordinates}")
-        if not verify_coordinates(coordinates):
-            raise ValueError(f"Invalid coordinates: {coordinates}")
+    item_id = stac_item.item_id.rsplit("_", 1)[0]
+    order_name = f"{stac_item.item_id}-{workspace}"
 
-        delivery_folder = "planet/commercial-data/orders"
+    logging.info(f"Coordinates: {coordinates}")
+    if not verify_coordinates(coordinates):
+        raise ValueError(f"Invalid coordinates: {coordinates}")
 
-        try:
-            # Submit an order for the given STAC item
-            logging.info(f"Ordering stac item {item_id} in {collection_id}")
-
-            order = asyncio.run(get_existing_order_details(workspace, order_name))
-            logging.info(f"Existing order: {order}")
-
-            order_status = order.get("state")
-            logging.info(f"Order status: {order_status}")
-            if order_status in ["queued", "running"]:
-                submitted_order_id = order.get("id")
-                reason = f"Order for {item_id} has already been submitted: {submitted_order_id}"
-                logging.info(reason)
-                update_stac_item_failure(
-                    stac_item.stac_json,
-                    stac_item.file_name,
-                    stac_item.collection_id,
-                    reason,
-                    workspace,
-                    workspace_bucket,
-                    None,
-                )
-                return
-
-            if order_status != "success":
-                credentials = get_credentials()
-
-                delivery_request = define_delivery(credentials, commercial_data_bucket, delivery_folder)
-                order_request = create_order_request(
-                    order_name,
-                    item_id,
-                    collection_id,
-                    delivery_request,
-                    product_bundle,
-                    coordinates,
-                )
-
-                asyncio.run(submit_order(workspace, order_request))
-
-                order = asyncio.run(get_existing_order_details(workspace, order_name))
-
-            order_id = order.get("id")
-            if not order_id:
-                raise ValueError(f"No order ID found for order {order_name}")
-            logging.info(f"Found order ID {order_id}")
+    delivery_folder = "planet/commercial-data/orders"
 
-        except Exception as e:
-            reason = f"Failed to submit order: {e}"
-            logging.error(reason, exc_info=True)
+    try:
+        # Submit an order for the given STAC item
+        logging.info(f"Ordering stac item {item_id} in {collection_id}")
+
+        order = asyncio.run(get_existing_order_details(workspace, order_name))
+        logging.info(f"Existing order: {order}")
+
+        order_status = order.get("state")
+        logging.info(f"Order status: {order_status}")
+        if order_status in ["queued", "running"]:
+            submitted_order_id = order.get("id")
+            reason = f"Order for {item_id} has already been submitted: {submitted_order_id}"
+            logging.info(reason)
             update_stac_item_failure(
                 stac_item.stac_json,
                 stac_item.file_name,
@@ -391,32 +398,119 @@ def main(
                 reason,
                 workspace,
                 workspace_bucket,
+                None,
+            )
+            return OrderStatus.FAILED.value
+
+        if order_status != "success":
+            credentials = get_credentials()
+
+            delivery_request = define_delivery(credentials, commercial_data_bucket, delivery_folder)
+            order_request = create_order_request(
                 order_name,
+                item_id,
+                collection_id,
+                delivery_request,
+                product_bundle,
+                coordinates,
             )
-            return
 
-        # Update the STAC record after submitting the order
-        update_stac_item_ordered(
+            # The created order already carries its ID, so there is no need to look it up again
+            order = asyncio.run(submit_order(workspace, order_request))
+
+        order_id = order.get("id")
+        if not order_id:
+            raise ValueError(f"No order ID found for order {order_name}")
+        logging.info(f"Found order ID {order_id}")
+
+    except Exception as e:
+        reason = f"Failed to submit order: {e}"
+        logging.error(reason, exc_info=True)
+        update_stac_item_failure(
             stac_item.stac_json,
+            stac_item.file_name,
             stac_item.collection_id,
-            stac_item.item_id,
-            order_id,
+            reason,
+            workspace,
             workspace_bucket,
-            pulsar_url,
+            order_name,
+        )
+        return OrderStatus.FAILED.value
+
+    # Update the STAC record after submitting the order
+    update_stac_item_ordered(
+        stac_item.stac_json,
+        stac_item.collection_id,
+        stac_item.item_id,
+        order_id,
+        workspace_bucket,
+        pulsar_url,
+        workspace,
+    )
+
+    try:
+        # Wait for data from planet to arrive, then move it to the workspace
+        poll_s3_for_data(
+            source_bucket=commercial_data_bucket,
+            order_id=order_id,
+            folder=delivery_folder,
+        )
+
+        download_and_store_locally(commercial_data_bucket, f"{delivery_folder}/{order_id}", order_id)
+    except Exception as e:
+        reason = f"Failed to retrieve data: {e}"
+        logging.error(reason, exc_info=True)
+        update_stac_item_failure(
+            stac_item.stac_json,
+            stac_item.file_name,
+            stac_item.collection_id,
+            reason,
             workspace,
+            workspace_bucket,
+            order_id,
         )
+        return OrderStatus.FAILED.value
+    update_stac_item_success(
+        stac_item.stac_json,
+        stac_item.file_name,
+        stac_item.collection_id,
+        order_name,
+        order_id,
+        workspace,
+        workspace_bucket,
+    )
+    return OrderStatus.SUCCEEDED.value
+
 
+def main(
+    workspace: str,
+    workspace_bucket: str,
+    commercial_data_bucket: str,
+    pulsar_url: str,
+    product_bundle_category: str,
+    coordinates: list,
+    catalogue_dirs: list[str],
+) -> None:
+    """Submit an order for an acquisition, retrieve the data, and update the STAC item"""
+    # Workspace STAC item should already be generated and ingested, with an order status of ordered.
+    logging.info(f"Preparing {product_bundle_category} data for {workspace} for the following: {catalogue_dirs}")
+    stac_items: list[STACItem] = prepare_stac_items_to_order(catalogue_dirs)
+
+    # Process each item independently, so that one failure does not stop the remaining orders
+    outcomes = []
+    for stac_item in stac_items:
         try:
-            # Wait for data from planet to arrive, then move it to the workspace
-            poll_s3_for_data(
-                source_bucket=commercial_data_bucket,
-                order_id=order_id,
-                folder=delivery_folder,
+            outcome = order_stac_item(
+                stac_item,
+                workspace,
+                workspace_bucket,
+                commercial_data_bucket,
+                pulsar_url,
+                product_bundle_category,
+                coordinates,
             )
-
-            download_and_store_locally(commercial_data_bucket, f"{delivery_folder}/{order_id}", order_id)
         except Exception as e:
-            reason = f"Failed to retrieve data: {e}"
+            reason = f"Failed to process order: {e}"
             logging.error(reason, exc_info=True)
             update_stac_item_failure(
                 stac_item.stac_json,
@@ -425,18 +519,12 @@ def main(
                 reason,
                 workspace,
                 workspace_bucket,
-                order_id,
+                None,
             )
-            return
-        update_stac_item_success(
-            stac_item.stac_json,
-            stac_item.file_name,
-            stac_item.collection_id,
-            order_name,
-            order_id,
-            workspace,
-            workspace_bucket,
-        )
+            outcome = OrderStatus.FAILED.value
+        outcomes.append((stac_item.item_id, outcome))
+
+    logging.info(f"Processed {len(outcomes)} STAC items: {outcomes}")
 
 
 if __name__ == "__main__":
@@ -455,7 +543,7 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    coordinates = json.loads(args.coordinates)
+    coordinates = json_utils.loads(args.coordinates)
 
     main(
         args.workspace,
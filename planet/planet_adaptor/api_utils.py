@@ -1,18 +1,60 @@
+import asyncio
 import base64
+import binascii
 import datetime
-import json
+import functools
 import logging
 import os
+import random
 import re
+import time
+from collections.abc import Callable
 from typing import Any
 
 import boto3
+from botocore.config import Config
 from kubernetes import client, config
+from kubernetes.client.exceptions import ApiException
 
 import planet
+from planet_adaptor import json_utils
 
 CLUSTER_PREFIX = os.getenv("CLUSTER_PREFIX", "eodhp")
 
+# HTTP status codes from the Kubernetes API that indicate a transient failure worth retrying
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Secrets Manager calls use botocore's own retry handling, which backs off with jitter
+SECRETS_MANAGER_CONFIG = Config(retries={"mode": "standard", "max_attempts": 5})
+
+
+def call_with_retry[T](fn: Callable[[], T], attempts: int = 5, base_delay: float = 0.1, max_delay: float = 10.0) -> T:
+    """Call a Kubernetes API function, retrying transient failures with capped exponential backoff and full jitter"""
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except ApiException as e:
+            attempt += 1
+            if attempt >= attempts or e.status not in RETRYABLE_STATUS_CODES:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            logging.warning(f"Transient Kubernetes API error ({e.status}), retrying in {delay:.2f} seconds...")
+            time.sleep(delay)
+
+
+@functools.cache
+def get_kubernetes_client() -> client.CoreV1Api:
+    """Return a Kubernetes API client, loading the in-cluster config on the first call only"""
+    config.load_incluster_config()
+    return client.CoreV1Api()
+
+
+@functools.cache
+def get_secrets_manager_client() -> Any:
+    """Return a shared AWS Secrets Manager client"""
+    return boto3.client("secretsmanager", config=SECRETS_MANAGER_CONFIG)
+
 
 def decrypt_planet_api_key(ciphertext_b64: str, otp_key_b64: str) -> str | None:
     """
@@ -24,15 +66,15 @@ def decrypt_planet_api_key(ciphertext_b64: str, otp_key_b64: str) -> str | None:
     """
 
     try:
-        # Decode both OTP key and ciphertext from Base64
-        ciphertext = base64.b64decode(ciphertext_b64)
-        otp_key = base64.b64decode(otp_key_b64)
+        # Decode both OTP key and ciphertext from Base64. binascii is what base64.b64decode calls underneath.
+        ciphertext = binascii.a2b_base64(ciphertext_b64)
+        otp_key = binascii.a2b_base64(otp_key_b64)
 
         if len(ciphertext) != len(otp_key):
             raise ValueError("Ciphertext and OTP key must be the same length.")
 
-        # XOR decryption
-        plaintext_bytes = bytes(c ^ k for c, k in zip(ciphertext, otp_key, strict=True))
+        # XOR decryption, as a single big integer operation rather than a Python loop over each byte
+        plaintext_bytes = (int.from_bytes(ciphertext) ^ int.from_bytes(otp_key)).to_bytes(len(ciphertext))
 
         try:
             return plaintext_bytes.decode("utf-8")
@@ -48,10 +90,12 @@ def decrypt_planet_api_key(ciphertext_b64: str, otp_key_b64: str) -> str | None:
         return None
 
 
-def get_planet_api_key(workspace: str) -> str | None:
+@functools.lru_cache(maxsize=8)
+def get_planet_api_key(workspace: str) -> str:
     """
     Retrieve an OTP (One-Time Pad) from Kubernetes Secrets and use it to decrypt
     an encrypted API key stored in AWS Secrets Manager.
+    The result is cached for the lifetime of the process; clear it with get_planet_api_key.cache_clear().
 
     Steps:
     1. Load Kubernetes config and initialize the API client.
@@ -63,14 +107,13 @@ def get_planet_api_key(workspace: str) -> str | None:
     provider = "planet"
 
     # Initialize Kubernetes API client
-    config.load_incluster_config()
-    v1 = client.CoreV1Api()
+    v1 = get_kubernetes_client()
     namespace = f"ws-{workspace}"
     secretId = f"{namespace}-{CLUSTER_PREFIX}"
 
     # Retrieve the OTP key from Kubernetes Secrets
     logging.info("Fetching OTP key from Kubernetes...")
-    secret_data = v1.read_namespaced_secret(f"otp-{provider}", namespace)
+    secret_data = call_with_retry(lambda: v1.read_namespaced_secret(f"otp-{provider}", namespace))
     otp_key_b64 = secret_data.data.get("otp")  # Adjusted key name for OTP
 
     if not otp_key_b64:
@@ -78,12 +121,12 @@ def get_planet_api_key(workspace: str) -> str | None:
 
     # Initialize AWS Secrets Manager client and fetch the provider's ciphertext
     logging.info(f"Fetching ciphertext for provider '{provider}' from AWS Secrets Manager...")
-    secrets_client = boto3.client("secretsmanager")
+    secrets_client = get_secrets_manager_client()
     response = secrets_client.get_secret_value(SecretId=secretId)
 
     # Extract the secret string and parse it as JSON
     secret_string = response.get("SecretString", "{}")
-    secret_dict = json.loads(secret_string)
+    secret_dict = json_utils.loads(secret_string)
 
     # Retrieve the encrypted API key (Base64 encoded ciphertext)
     ciphertext_b64 = secret_dict.get(provider)
@@ -93,19 +136,23 @@ def get_planet_api_key(workspace: str) -> str | None:
     # Decrypt the API key using the OTP key
     plaintext_api_key = decrypt_planet_api_key(ciphertext_b64, otp_key_b64)
 
+    # Raise rather than return None, so that a failed decryption is not cached and is retried for the next item
+    if not plaintext_api_key:
+        raise ValueError(f"Failed to decrypt API key for provider {provider}.")
+
     logging.info(f"Successfully fetched API key for {provider}")
 
     return plaintext_api_key
 
 
+@functools.lru_cache(maxsize=8)
 def get_aws_api_key_from_secret(secret_name: str, secret_key: str, namespace: str = "ws-planet") -> str:
     """Retrieve an API key from a Kubernetes secret"""
     # Create a Kubernetes API client
-    config.load_incluster_config()
-    v1 = client.CoreV1Api()
+    v1 = get_kubernetes_client()
 
     # Retrieve and decode the secret
-    secret = v1.read_namespaced_secret(secret_name, namespace)
+    secret = call_with_retry(lambda: v1.read_namespaced_secret(secret_name, namespace))
     api_key_base64 = secret.data[secret_key]
     api_key = base64.b64decode(api_key_base64).decode("utf-8")
 
@@ -183,9 +230,10 @@ def create_order_request(
     return order
 
 
-async def submit_order(workspace: str, order_details: dict) -> Any:
-    """Submit an order for Planet data"""
-    planet_api_key = get_planet_api_key(workspace)
+async def submit_order(workspace: str, order_details: dict) -> dict:
+    """Submit an order for Planet data, returning the created order"""
+    # Fetching the key blocks on Kubernetes and Secrets Manager calls, so keep it off the event loop
+    planet_api_key = await asyncio.to_thread(get_planet_api_key, workspace)
     auth = planet.Auth.from_key(planet_api_key)
     async with planet.Session(auth=auth) as sess:
         # 'orders' is the service name for the Orders API.
@@ -195,6 +243,10 @@ async def submit_order(workspace: str, order_details: dict) -> Any:
             return order
 
         except Exception as e:
+            if isinstance(e, planet.exceptions.InvalidAPIKey):
+                # The cached key has been rejected, so fetch it again next time
+                get_planet_api_key.cache_clear()
+
             message = str(e)
             if "400 Bad Request" in message or "Unable to accept order" in message:
                 search = re.compile(r"([0-9]{8}_[0-9]{6})")
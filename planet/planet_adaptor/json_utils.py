@@ -0,0 +1,24 @@
+import json
+from typing import Any
+
+# orjson is much faster than the standard library, but fall back to json if it is not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data: bytes | str) -> Any:
+    """Parse a JSON document from bytes or a string"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any, indent: bool = False) -> bytes:
+    """Serialise an object to UTF-8 encoded JSON, compact unless indent is set"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
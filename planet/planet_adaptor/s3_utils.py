@@ -1,12 +1,62 @@
-import json
+import functools
+import hashlib
+import io
 import logging
 import os
+import random
+import threading
 import time
 import zipfile
+from collections.abc import Buffer, Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import IO, Any
 
 import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from s3transfer.futures import TransferFuture
+from s3transfer.manager import TransferManager
+from s3transfer.subscribers import BaseSubscriber
 
-s3_client = boto3.client("s3")
+from planet_adaptor import json_utils
+
+MB = 1024 * 1024
+
+# Large objects are fetched as concurrent ranged GETs, and many objects are fetched at once
+transfer_config = TransferConfig(
+    multipart_threshold=64 * MB,
+    multipart_chunksize=16 * MB,
+    max_concurrency=32,
+    use_threads=True,
+)
+
+# Shared by every S3 call in the adaptor. The connection pool is larger than the transfer concurrency so that
+# transfer threads never wait for a connection, TCP keepalive stops idle pooled connections from being dropped
+# during long polls, and adaptive retries slow down on throttling.
+s3_client = boto3.client(
+    "s3",
+    config=Config(max_pool_connections=64, tcp_keepalive=True, retries={"mode": "adaptive", "max_attempts": 10}),
+)
+
+# Maximum number of downloaded archives extracted at once
+EXTRACTION_WORKERS = 4
+
+# Maximum number of members of a single local archive extracted at once. Decompression releases the GIL, but
+# os.cpu_count() reports the node's cores rather than the pod's CPU limit, so keep this small.
+MEMBER_EXTRACTION_WORKERS = min(4, os.cpu_count() or 1)
+
+# Maximum number of existing local files compared against their S3 objects at once
+DOWNLOAD_CHECK_WORKERS = 4
+
+# Maximum number of STAC items uploaded at once
+UPLOAD_WORKERS = 16
+
+# Archives up to this size are downloaded into memory instead of to disk before extraction
+IN_MEMORY_ARCHIVE_MAX_BYTES = 256 * MB
+
+# Maximum total size of the archives held in memory at once. Archives beyond this are downloaded to disk instead.
+IN_MEMORY_ARCHIVES_TOTAL_MAX_BYTES = 512 * MB
 
 
 class PollingTimeoutError(Exception):
@@ -22,27 +72,50 @@ def poll_s3_for_data(
     polling_interval: int = 60,
     timeout: int = 86400,
 ) -> dict:
-    """Poll the planet S3 bucket for item_id and download the data"""
-    start_time = time.time()
-    end_time = start_time + timeout
+    """
+    Poll the planet S3 bucket for item_id and download the data.
+    Checks back off exponentially with jitter, up to polling_interval seconds apart.
+    """
+    # Monotonic time is unaffected by changes to the system clock during long polls
+    end_time = time.monotonic() + timeout
+    attempt = 0
+
+    # manifest.json is the final file to be delivered, at a known key within the order folder
+    manifest_key = f"{folder}/{order_id}/manifest.json"
+    checking_message = f"Checking for {manifest_key} in bucket {source_bucket}..."
 
     while True:
-        # Check if the folder containing the order exists in the source bucket
-        logging.info(f"Checking for {folder} folder in bucket {source_bucket}...")
-        response = s3_client.list_objects_v2(Bucket=source_bucket, Prefix=folder)
-        for obj in response.get("Contents", []):
-            if obj["Key"].endswith(f"/{order_id}/manifest.json"):  # manifest.json is the final file to be delivered
-                logging.info(f"Data available: file '{obj['Key']}' found in bucket '{source_bucket}'.")
-                return obj
+        # Check if the manifest for the order exists in the source bucket
+        logging.info(checking_message)
+        try:
+            response = s3_client.head_object(Bucket=source_bucket, Key=manifest_key)
+        except ClientError as e:
+            # HEAD responses have no body, so a throttled request reports its status code as the error code
+            error_code = e.response["Error"]["Code"]
+            if error_code in ("SlowDown", "503"):
+                logging.warning(f"S3 is throttling requests to bucket {source_bucket}, backing off before retrying.")
+            elif error_code not in ("404", "NoSuchKey"):
+                raise
+        else:
+            logging.info(f"Data available: file '{manifest_key}' found in bucket '{source_bucket}'.")
+            return {
+                "Key": manifest_key,
+                "LastModified": response["LastModified"],
+                "ETag": response["ETag"],
+                "Size": response["ContentLength"],
+            }
 
         # Check for timeout
-        if time.time() > end_time:
+        if time.monotonic() > end_time:
             raise PollingTimeoutError(
                 f"Timeout reached while polling for {order_id} in bucket {source_bucket} after {timeout} seconds."
             )
 
-        # Wait for the specified interval before checking again
-        time.sleep(polling_interval)
+        # Wait before checking again, backing off towards the polling interval
+        delay = min(polling_interval, 2**attempt + random.uniform(0, 1))
+        if delay < polling_interval:
+            attempt += 1
+        time.sleep(delay)
 
 
 def download_and_store_locally(source_bucket: str, parent_folder: str, destination_folder: str) -> None:
@@ -51,25 +124,325 @@ def download_and_store_locally(source_bucket: str, parent_folder: str, destinati
     if not os.path.exists(destination_folder):
         os.makedirs(destination_folder)
 
-    response = s3_client.list_objects_v2(Bucket=source_bucket, Prefix=parent_folder)
+    # Orders can contain more than the 1000 keys returned by a single listing request
+    paginator = s3_client.get_paginator("list_objects_v2")
+
+    # Queue every file for download at once. Each archive is extracted as soon as its own download finishes,
+    # while the remaining downloads continue.
+    downloads = []
+    checks: list[Future] = []
+    extractions: list[Future] = []
+    memory_budget = MemoryBudget(IN_MEMORY_ARCHIVES_TOTAL_MAX_BYTES)
+    with (
+        ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS) as extraction_executor,
+        create_transfer_manager(s3_client, transfer_config) as transfer_manager,
+        ThreadPoolExecutor(max_workers=DOWNLOAD_CHECK_WORKERS) as check_executor,
+    ):
+        for page in paginator.paginate(Bucket=source_bucket, Prefix=parent_folder):
+            for obj in page.get("Contents", []):
+                if not obj["Key"].endswith("/"):
+                    logging.info(f"File '{obj['Key']}' found in bucket '{source_bucket}'.")
+                    if obj["Key"].endswith(".zip"):
+                        if obj["Size"] > IN_MEMORY_ARCHIVE_MAX_BYTES:
+                            # Large archives are extracted straight from S3, so they never take up local disk space
+                            logging.info(f"Large zip file found. Extracting '{obj['Key']}' directly from S3...")
+                            # A single reader reads forward through the archive once, so it is only fetched once
+                            open_archive = functools.partial(S3RangeReader, source_bucket, obj["Key"], obj["Size"])
+                            extractions.append(
+                                extraction_executor.submit(extract_zip_archive, open_archive, destination_folder, 1)
+                            )
+                            continue
+
+                        archive: io.BytesIO | str
+                        if memory_budget.reserve(obj["Size"]):
+                            # Small archives are held in memory, as they would only be deleted after extraction
+                            archive = io.BytesIO()
+                            subscriber = ArchiveExtractionSubscriber(
+                                archive,
+                                destination_folder,
+                                extraction_executor,
+                                extractions,
+                                memory_budget,
+                                obj["Size"],
+                            )
+                        else:
+                            # Once the archives in memory reach their limit, the rest go through disk
+                            archive = os.path.join(destination_folder, os.path.basename(obj["Key"]))
+                            subscriber = ArchiveExtractionSubscriber(
+                                archive, destination_folder, extraction_executor, extractions
+                            )
+                        future = transfer_manager.download(
+                            source_bucket, obj["Key"], archive, subscribers=[subscriber]
+                        )
+                        downloads.append(future)
+                        continue
+
+                    destination = os.path.join(destination_folder, os.path.basename(obj["Key"]))
+                    if os.path.exists(destination):
+                        # Hashing a file left by an earlier attempt can be slow, so compare it on the check pool and
+                        # keep listing
+                        checks.append(
+                            check_executor.submit(
+                                download_unless_present, transfer_manager, source_bucket, obj, destination
+                            )
+                        )
+                    else:
+                        downloads.append(download_unless_present(transfer_manager, source_bucket, obj, destination))
+
+        # Collect the downloads queued after a check, then re-raise any check or download failure
+        for check in checks:
+            downloads.append(check.result())
+        for future in downloads:
+            if future is not None:
+                future.result()
+
+    # Re-raise any extraction failure
+    for extraction in extractions:
+        extraction.result()
+
+
+class MemoryBudget:
+    """Thread-safe count of the bytes of archives that may still be held in memory"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.available = max_bytes
+        self.lock = threading.Lock()
+
+    def reserve(self, size: int) -> bool:
+        """Reserve size bytes if they are available, returning whether they were reserved"""
+        with self.lock:
+            if size > self.available:
+                return False
+            self.available -= size
+            return True
+
+    def release(self, size: int) -> None:
+        """Return size bytes reserved earlier"""
+        with self.lock:
+            self.available += size
+
+
+class DownloadLoggingSubscriber(BaseSubscriber):
+    """Logs each file downloaded to disk as soon as its download finishes"""
+
+    def on_done(self, future: TransferFuture, **kwargs: Any) -> None:
+        try:
+            future.result()
+        except Exception:
+            # The failure is re-raised where the download is waited on
+            return
+
+        call_args = future.meta.call_args
+        logging.info(f"Downloaded '{call_args.key}' from bucket '{call_args.bucket}' to '{call_args.fileobj}'.")
+
+
+class ArchiveExtractionSubscriber(BaseSubscriber):
+    """Hands a downloaded archive to the extraction pool as soon as its own download finishes"""
+
+    def __init__(
+        self,
+        archive: io.BytesIO | str,
+        destination_folder: str,
+        extraction_executor: ThreadPoolExecutor,
+        extractions: list[Future],
+        memory_budget: MemoryBudget | None = None,
+        size: int = 0,
+    ) -> None:
+        self.archive = archive
+        self.destination_folder = destination_folder
+        self.extraction_executor = extraction_executor
+        self.extractions = extractions
+        self.memory_budget = memory_budget
+        self.size = size
+
+    def on_done(self, future: TransferFuture, **kwargs: Any) -> None:
+        try:
+            future.result()
+        except Exception:
+            # The failure is re-raised where the download is waited on
+            self.release_memory()
+            return
+
+        call_args = future.meta.call_args
+        if isinstance(self.archive, str):
+            logging.info(f"Downloaded '{call_args.key}' from bucket '{call_args.bucket}' to '{self.archive}'.")
+
+            # Planet orders may arrive as a .zip file
+            logging.info("Zip file found. Unzipping...")
+            extraction = self.extraction_executor.submit(
+                extract_and_remove_zip_archive, self.archive, self.destination_folder
+            )
+        else:
+            logging.info(f"Downloaded '{call_args.key}' from bucket '{call_args.bucket}' into memory.")
+
+            # Planet orders may arrive as a .zip file
+            logging.info("Zip file found. Unzipping...")
+            # Each extraction worker reads from its own BytesIO, all sharing the downloaded bytes. Closing the
+            # download buffer leaves those bytes as the only copy, freed once extraction finishes.
+            open_archive = functools.partial(io.BytesIO, self.archive.getvalue())
+            self.archive.close()
+            extraction = self.extraction_executor.submit(extract_zip_archive, open_archive, self.destination_folder)
+            extraction.add_done_callback(lambda _: self.release_memory())
+        self.extractions.append(extraction)
+
+    def release_memory(self) -> None:
+        """Close an in-memory archive and return its size to the memory budget"""
+        if isinstance(self.archive, io.BytesIO):
+            self.archive.close()
+        if self.memory_budget is not None:
+            self.memory_budget.release(self.size)
 
-    for obj in response.get("Contents", []):
-        if not obj["Key"].endswith("/"):
-            logging.info(f"File '{obj['Key']}' found in bucket '{source_bucket}'.")
-            destination_file_path = os.path.join(destination_folder, os.path.basename(obj["Key"]))
-            s3_client.download_file(source_bucket, obj["Key"], destination_file_path)
-            logging.info(f"Downloaded '{obj['Key']}' from bucket '{source_bucket}' to '{destination_file_path}'.")
 
-            if obj["Key"].endswith(".zip"):
-                # Planet orders may arrive as a .zip file
-                logging.info("Zip file found. Unzipping...")
+def download_unless_present(
+    transfer_manager: TransferManager, bucket: str, obj: dict, destination: str
+) -> TransferFuture | None:
+    """Queue the download of an S3 object to a local file, unless a matching copy is already there"""
+    if is_already_downloaded(destination, obj):
+        logging.info(f"File '{destination}' is already downloaded, skipping.")
+        return None
+    return transfer_manager.download(bucket, obj["Key"], destination, subscribers=[DownloadLoggingSubscriber()])
 
-                # Extract the contents of the .zip file
-                with zipfile.ZipFile(destination_file_path) as z:
-                    z.extractall(path=destination_folder)
-                    logging.info(f"Extracted '{obj['Key']}' to '{destination_folder}'.")
-                os.remove(destination_file_path)
-                logging.info(f"Deleted archive '{destination_file_path}'.")
+
+def is_already_downloaded(file_path: str, obj: dict) -> bool:
+    """Check whether a local file matches an S3 object, e.g. from an earlier attempt at the same order"""
+    if not os.path.exists(file_path) or os.path.getsize(file_path) != obj["Size"]:
+        return False
+
+    # Multipart uploads have an ETag of the form '"<md5 of part md5s>-<part count>"', so only the size can be compared
+    etag = obj["ETag"].strip('"')
+    if "-" in etag:
+        return True
+
+    with open(file_path, "rb") as f:
+        return hashlib.file_digest(f, "md5").hexdigest() == etag
+
+
+class S3RangeReader(io.RawIOBase):
+    """Read-only, seekable file object over an S3 object, fetching it in blocks of byte ranges as it is read"""
+
+    def __init__(self, bucket: str, key: str, size: int, block_size: int = 16 * MB) -> None:
+        super().__init__()
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.block_size = block_size
+        self.position = 0
+        self.block_start = 0
+        self.block = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence value: {whence}")
+
+        # Like a real file, refuse to seek before the start. zipfile relies on this to detect small archives.
+        if position < 0:
+            raise OSError(f"Negative seek position {position}")
+        self.position = position
+        return self.position
+
+    def read(self, size: int | None = -1) -> bytes:
+        """Read up to size bytes, or to the end of the object, fetching further blocks from S3 as needed"""
+        if size is None or size < 0:
+            size = self.size - self.position
+
+        chunks = []
+        while size > 0 and self.position < self.size:
+            offset = self.position - self.block_start
+            if not 0 <= offset < len(self.block):
+                self._fetch_block()
+                offset = 0
+            chunk = self.block[offset : offset + size]
+            chunks.append(chunk)
+            self.position += len(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def readinto(self, buffer: Buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        data = self.read(len(view))
+        view[: len(data)] = data
+        return len(data)
+
+    def _fetch_block(self) -> None:
+        """Fetch the block of the object starting at the current position"""
+        end = min(self.position + self.block_size, self.size) - 1
+        response = s3_client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.position}-{end}")
+        self.block = response["Body"].read()
+        self.block_start = self.position
+
+
+def extract_zip_archive(
+    open_archive: Callable[[], IO[bytes] | S3RangeReader],
+    destination_folder: str,
+    workers: int = MEMBER_EXTRACTION_WORKERS,
+) -> None:
+    """Extract the contents of a .zip file into a folder, decompressing its members on up to workers threads"""
+    with zipfile.ZipFile(open_archive()) as z:
+        members = z.infolist()
+
+        # Before Python 3.13, zipfile creates missing directories without exist_ok, so threads extracting members of
+        # the same new directory, from this or another archive, race to create it. Create every directory first, so
+        # zipfile never needs to.
+        directories = set()
+        for member in members:
+            member_path = zip_member_path(member, destination_folder)
+            directories.add(member_path if member.is_dir() else os.path.dirname(member_path))
+        for directory in directories:
+            os.makedirs(directory, exist_ok=True)
+
+        if workers == 1:
+            z.extractall(path=destination_folder)
+
+    if workers > 1:
+        # A ZipFile cannot be read from several threads at once, so each worker extracts a contiguous share of the
+        # members through its own file object
+        share_size = max(1, -(-len(members) // workers))
+        shares = [members[i : i + share_size] for i in range(0, len(members), share_size)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(extract_zip_members, open_archive, share, destination_folder) for share in shares
+            ]
+
+        # Re-raise any extraction failure
+        for future in futures:
+            future.result()
+    logging.info(f"Extracted {len(members)} files to '{destination_folder}'.")
+
+
+def zip_member_path(member: zipfile.ZipInfo, destination_folder: str) -> str:
+    """Return the path zipfile extracts a member to, ignoring empty, '.' and '..' components as zipfile does"""
+    parts = [part for part in member.filename.split("/") if part not in ("", os.path.curdir, os.path.pardir)]
+    return os.path.normpath(os.path.join(destination_folder, *parts))
+
+
+def extract_and_remove_zip_archive(archive_path: str, destination_folder: str) -> None:
+    """Extract the contents of a local .zip file into a folder, then delete the archive"""
+    extract_zip_archive(functools.partial(open, archive_path, "rb"), destination_folder)
+    os.remove(archive_path)
+
+
+def extract_zip_members(
+    open_archive: Callable[[], IO[bytes] | S3RangeReader], members: list[zipfile.ZipInfo], destination_folder: str
+) -> None:
+    """Extract the given members of a .zip file into a folder"""
+    with zipfile.ZipFile(open_archive()) as z:
+        for member in members:
+            z.extract(member, path=destination_folder)
 
 
 def retrieve_stac_item(file_path: str) -> dict:
@@ -77,6 +450,31 @@ def retrieve_stac_item(file_path: str) -> dict:
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"The file {file_path} does not exist.")
 
-    with open(file_path, encoding="utf-8") as f:
-        stac_item = json.load(f)
+    with open(file_path, "rb") as f:
+        stac_item = json_utils.loads(f.read())
     return stac_item
+
+
+def upload_stac_item_raw(bucket: str, key: str, body: bytes) -> None:
+    """Upload an already serialised STAC item to an S3 bucket"""
+    s3_client.put_object(Body=body, Bucket=bucket, Key=key)
+    logging.info(f"Uploaded STAC item to S3 bucket '{bucket}' with key '{key}'.")
+
+
+def upload_stac_items(bucket: str, stac_items: dict[str, dict]) -> None:
+    """Upload STAC items to an S3 bucket concurrently, given as a mapping of object key to item"""
+    # The same item is often uploaded to several keys, so serialise each distinct item only once
+    bodies = {}
+    for stac_item in stac_items.values():
+        if id(stac_item) not in bodies:
+            bodies[id(stac_item)] = json_utils.dumps(stac_item)
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        futures = [
+            executor.submit(upload_stac_item_raw, bucket, key, bodies[id(stac_item)])
+            for key, stac_item in stac_items.items()
+        ]
+
+        # Raise any upload failure
+        for future in futures:
+            future.result()
@@ -1,13 +1,31 @@
-import json
+import copy
+import itertools
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import UTC, datetime
-from typing import Any
+from pathlib import Path
 
-import boto3
+from planet_adaptor import json_utils
+from planet_adaptor.s3_utils import s3_client
 
 Coordinate = list[float] | tuple[float, float]
 
+# Catalog written when no existing Planet catalog is found in the workspace
+DEFAULT_STAC_CATALOG = {
+    "stac_version": "1.0.0",
+    "id": "planet",
+    "type": "Catalog",
+    "description": "Order records for Planet, including completed purchases with their associated assets, as well as records of ongoing and failed orders.",
+    "links": [],
+}
+
+# Links of the local catalog, which always points to the single local collection
+STAC_CATALOG_LINKS = [
+    {"rel": "self", "href": "catalog.json", "type": "application/json"},
+    {"rel": "child", "href": "collection.json", "type": "application/json"},
+]
+
 
 def current_time_iso8601() -> str:
     """Return the current time in ISO 8601 format"""
@@ -30,52 +48,42 @@ def write_stac_item_and_catalog(
     ]
 
     # Write the STAC item to a file
-    with open(stac_item_filename, "w") as f:
-        json.dump(stac_item, f, indent=2)
+    write_json_file(stac_item_filename, stac_item)
     logging.info(f"Created STAC item '{stac_item_filename}' locally.")
-    logging.info(f"STAC item: {stac_item}")
+    logging.debug("STAC item: %s", stac_item)
 
     # If not item_id, the order has failed
     if not item_id:
         item_id = "Failed"
 
+    # Fetch the existing catalog and collection from s3 concurrently
+    catalog_key = f"{workspace}/commercial-data/planet.json"
+    collection_key = f"{workspace}/commercial-data/planet/{collection_id}.json"
+    logging.info(f"Retrieving existing catalog from s3: {catalog_key}, {workspaces_bucket}")
+    logging.info(f"Retrieving existing collection from s3: {collection_key}, {workspaces_bucket}")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        catalog_future = executor.submit(retrieve_json_from_s3, workspaces_bucket, catalog_key)
+        collection_future = executor.submit(retrieve_json_from_s3, workspaces_bucket, collection_key)
+
     # Create containing STAC catalog
     try:
-        # obtain the existing catalog from s3 if possible
-        s3_client = boto3.client("s3")
-        key = f"{workspace}/commercial-data/planet.json"
-        logging.info(f"Retrieving existing catalog from s3: {key}, {workspaces_bucket}")
-        response = s3_client.get_object(Bucket=workspaces_bucket, Key=key)
-        stac_catalog = json.loads(response["Body"].read())
+        # use the existing catalog from s3 if possible
+        stac_catalog = catalog_future.result()
 
     except Exception as e:
         logging.info(f"Failed to retrieve existing collection from s3: {e}")
         logging.info("Creating default collection")
-        stac_catalog = {
-            "stac_version": "1.0.0",
-            "id": "planet",
-            "type": "Catalog",
-            "description": "Order records for Planet, including completed purchases with their associated assets, as well as records of ongoing and failed orders.",
-            "links": [],
-        }
-    stac_catalog["links"] = [
-        {"rel": "self", "href": "catalog.json", "type": "application/json"},
-        {"rel": "child", "href": "collection.json", "type": "application/json"},
-    ]
+        stac_catalog = copy.deepcopy(DEFAULT_STAC_CATALOG)
+    stac_catalog["links"] = copy.deepcopy(STAC_CATALOG_LINKS)
 
     # Write the STAC catalog to a file
-    with open("catalog.json", "w") as f:
-        json.dump(stac_catalog, f, indent=2)
+    write_json_file("catalog.json", stac_catalog)
     logging.info("Created STAC catalog catalog.json locally.")
-    logging.info(f"STAC catalog: {stac_catalog}")
+    logging.debug("STAC catalog: %s", stac_catalog)
 
     try:
-        # obtain the existing collection from s3 if possible
-        s3_client = boto3.client("s3")
-        key = f"{workspace}/commercial-data/planet/{collection_id}.json"
-        logging.info(f"Retrieving existing collection from s3: {key}, {workspaces_bucket}")
-        response = s3_client.get_object(Bucket=workspaces_bucket, Key=key)
-        stac_collection = json.loads(response["Body"].read())
+        # use the existing collection from s3 if possible
+        stac_collection = collection_future.result()
 
     except Exception as e:
         logging.info(f"Failed to retrieve existing collection from s3: {e}")
@@ -108,11 +116,22 @@ def write_stac_item_and_catalog(
     ]
 
     # Write the STAC catalog to a file
-    with open("collection.json", "w") as f:
-        json.dump(stac_collection, f, indent=2)
+    write_json_file("collection.json", stac_collection)
     logging.info("Created STAC collection collection.json locally.")
-    logging.debug(f"STAC collection: {stac_collection}")
-    logging.info(f"STAC collection: {stac_collection}")
+    logging.debug("STAC collection: %s", stac_collection)
+
+
+def write_json_file(file_path: str, data: dict) -> None:
+    """Write a JSON file atomically, so a partially written file is never left in place"""
+    temp_path = Path(f"{file_path}.tmp")
+    temp_path.write_bytes(json_utils.dumps(data, indent=True))
+    os.replace(temp_path, file_path)
+
+
+def retrieve_json_from_s3(bucket: str, key: str) -> dict:
+    """Retrieve and parse a JSON file from s3"""
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    return json_utils.loads(response["Body"].read())
 
 
 def update_stac_order_status(stac_item: dict, order_id: str | None, order_status: str) -> None:
@@ -134,36 +153,20 @@ def update_stac_order_status(stac_item: dict, order_id: str | None, order_status
         stac_item["stac_extensions"].append(order_extension_url)
 
 
-def get_key_from_stac(stac_item: dict, key: str) -> Any:
-    """Extract a nested key from a STAC item. Key given as a dot-separated string."""
-    parts = key.split(".")
-    value = stac_item
-    for part in parts:
-        value = value.get(part)
-        if value is None:
-            logging.info(f"{part} not found in STAC item.")
-            return None
-    logging.info(f"Retrieved {key} from STAC item: {value}")
-    return value
-
-
 def get_item_hrefs_from_catalogue(catalogue_dir: str) -> list:
     """Return a list of all hrefs to items in the STAC catalog"""
     catalog_path = os.path.join(catalogue_dir, "catalog.json")
     if not os.path.exists(catalog_path):
         raise FileNotFoundError(f"The file {catalog_path} does not exist.")
 
-    with open(catalog_path, encoding="utf-8") as f:
-        catalog = json.load(f)
-
-    item_hrefs = []
-    for link in catalog.get("links", []):
-        if link.get("rel") == "item":
-            href = link.get("href")
-            absolute_href = os.path.normpath(os.path.join(catalogue_dir, href))
-            item_hrefs.append(absolute_href)
+    with open(catalog_path, "rb") as f:
+        catalog = json_utils.loads(f.read())
 
-    return item_hrefs
+    return [
+        os.path.normpath(os.path.join(catalogue_dir, link.get("href")))
+        for link in catalog.get("links", [])
+        if link.get("rel") == "item"
+    ]
 
 
 def is_valid_coordinate(coordinate: Coordinate) -> bool:
@@ -185,4 +188,4 @@ def is_valid_coordinate(coordinate: Coordinate) -> bool:
 
 def verify_coordinates(coordinates: list[list[Coordinate]]) -> bool:
     """Verify that a list of coordinates is valid."""
-    return all(all(is_valid_coordinate(coord) for coord in polygons) for polygons in coordinates)
+    return all(is_valid_coordinate(coord) for coord in itertools.chain.from_iterable(coordinates))